@@ -6,87 +6,136 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
-import subprocess
+import concurrent.futures
 import re
+import subprocess
+import string
 import sys
-import os
-print(sys.version_info)
-if sys.version_info.major != 3 or sys.version_info.minor != 5:
-    # Python 3.5 has issues with typing module
-    from typing import List, Text, Union, IO, Any
+from typing import TYPE_CHECKING
 
-if sys.version_info[0] == 3:
-    DEVNULL = subprocess.DEVNULL  # type: Union[IO[Any], int]
-else:
-    # Python 2 doesn't have DEVNULL
-    DEVNULL = open(os.devnull, 'wb')
+if TYPE_CHECKING:
+    # Only needed for the type comments, not at runtime
+    from typing import Dict, List, Optional, Text, Set
 
 
-OFFICIAL_REPO_URL_PREFIXES = [
-    'https://github\\.com/onnx/',
-    'git@github\\.com:onnx/',
-    'https://github\\.com/caffe2/',
-    'git@github\\.com:caffe2/',
-    'https://github\\.com/pytorch/',
-    'git@github\\.com:pytorch/',
-]
+OFFICIAL_OWNERS = frozenset([
+    'onnx',
+    'caffe2',
+    'pytorch',
+])
 
+GITHUB_URL_PREFIXES = ('https://github.com/', 'git@github.com:')
 
-def _contains(list, regex):  # type: (List[Text], Text) -> bool
-    matches = [item for item in list if re.match(regex, item)]
-    return len(matches) > 0
+_GITHUB_NAME_CHARS = frozenset(string.ascii_letters + string.digits + '-')
 
 
-def _get_current_branch():  # type: () -> Text
-    return subprocess.check_output(['git', 'rev-parse', '--abbrev-ref', 'HEAD']).decode('UTF-8').strip()
+def _is_github_name(name):  # type: (Text) -> bool
+    return len(name) > 0 and _GITHUB_NAME_CHARS.issuperset(name)
+
+
+def _parse_github_owner(url):  # type: (Text) -> Optional[Text]
+    # Equivalent to matching "<prefix>[a-zA-Z0-9\-]+/[a-zA-Z0-9\-]+(\.git)?", but with plain string operations
+    for prefix in GITHUB_URL_PREFIXES:
+        if url.startswith(prefix):
+            path = url[len(prefix):]
+            if path.endswith('.git'):
+                path = path[:-len('.git')]
+            owner, _, repo = path.partition('/')
+            if _is_github_name(owner) and _is_github_name(repo):
+                return owner
+    return None
 
 
-def _remote_has_branch(remote, branch):  # type: (Text, Text) -> bool
-    output = subprocess.check_output(['git', 'ls-remote', '--heads', remote, branch]).decode('UTF-8').strip()
-    return output != ''
+REMOTE_DIRECTIONS = ('fetch', 'push')
 
 
-def _local_has_branch(branch):  # type: (Text) -> bool
+def _get_remote_urls(remote, direction):  # type: (Text, Text) -> List[Text]
+    # Git only fetches from the first URL of a remote, but pushes to all of them
+    command = ['git', 'remote', 'get-url']
+    if direction == 'push':
+        command.extend(['--push', '--all'])
+    command.append(remote)
     try:
-        subprocess.check_call(['git', 'rev-parse', '--verify', branch], stdout=DEVNULL, stderr=DEVNULL)  # type: ignore
-        return True
+        output = subprocess.check_output(command, stderr=subprocess.DEVNULL)
     except subprocess.CalledProcessError:
-        return False
+        return []
+    return output.decode('UTF-8').splitlines()
 
 
-def _exec(commands):  # type: (List[List[Text]]) -> None
-    print("# Will run command sequence:")
-    for command in commands:
-        print("# $> %s" % " ".join(command))
+def _get_github_owners(urls):  # type: (List[Text]) -> Set[Text]
+    owners = set()  # type: Set[Text]
+    for url in urls:
+        owner = _parse_github_owner(url)
+        if owner is not None:
+            owners.add(owner)
+    return owners
+
+
+def _get_remote_owners(remote):  # type: (Text) -> Dict[Text, Set[Text]]
+    return dict((direction, _get_github_owners(_get_remote_urls(remote, direction))) for direction in REMOTE_DIRECTIONS)
+
+
+def _get_current_branch():  # type: () -> Text
+    return subprocess.check_output(['git', 'rev-parse', '--abbrev-ref', 'HEAD']).rstrip(b'\n').decode('UTF-8')
+
+
+def _get_local_branches():  # type: () -> Set[Text]
+    output = subprocess.check_output(['git', 'for-each-ref', '--format=%(refname)', 'refs/heads/']).decode('UTF-8')
+    return set(ref[len('refs/heads/'):] for ref in output.split('\n') if ref.startswith('refs/heads/'))
+
+
+def _get_remote_branches(remote):  # type: (Text) -> Set[Text]
+    # Parse the raw output and only decode the branch names, since the SHAs aren't needed
+    output = subprocess.check_output(['git', 'ls-remote', '--heads', remote])
+    branches = set()  # type: Set[Text]
+    for line in output.splitlines():
+        ref = line.partition(b'\t')[2]
+        if ref.startswith(b'refs/heads/'):
+            branches.add(ref[len(b'refs/heads/'):].decode('UTF-8'))
+    return branches
+
+
+def _print_preview(rendered):  # type: (List[Text]) -> None
+    # Written in one go instead of one print() per line
+    sys.stdout.write(
+        "# Will run command sequence:\n" +
+        "".join("# $> %s\n" % command for command in rendered) +
+        "\n" +
+        "-----------------------------------------------------------\n" +
+        "Off we go...\n" +
+        "-----------------------------------------------------------\n")
+
+
+def _fail_at(rendered, i):  # type: (List[Text], int) -> None
     print()
     print('-----------------------------------------------------------')
-    print('Off we go...')
+    print("This command failed:")
+    print("$> %s" % rendered[i])
+    print()
+    if (i == len(rendered)-1):
+        print("Please fix it and rerun it, then the action is finished.")
+    else:
+        print("Please fix, rerun it, and then, to finish the action, run:")
+        for command in rendered[i + 1:]:
+            print("$> %s" % command)
     print('-----------------------------------------------------------')
+    raise SystemExit(1)
+
+
+def _exec(commands):  # type: (List[List[Text]]) -> None
+    rendered = [" ".join(command) for command in commands]
+    _print_preview(rendered)
     for i in range(len(commands)):
-        command = commands[i]
-        print("$> %s" % " ".join(command))
+        print("$> %s" % rendered[i])
         try:
-            subprocess.check_call(command)
+            subprocess.check_call(commands[i])
             print()
         except subprocess.CalledProcessError:
-            print()
-            print('-----------------------------------------------------------')
-            print("This command failed:")
-            print("$> %s" % " ".join(command))
-            print()
-            if (i == len(commands)-1):
-                print("Please fix it and rerun it, then the action is finished.")
-            else:
-                print("Please fix, rerun it, and then, to finish the action, run:")
-                for j in range(i + 1, len(commands)):
-                    print("$> %s" % " ".join(commands[j]))
-            print('-----------------------------------------------------------')
-            exit(1)
+            _fail_at(rendered, i)
 
 
 def _error(message):  # type: (Text) -> None
-    print("Error: %s" % message)
-    exit(1)
+    raise SystemExit("Error: %s" % message)
 
 
 def _check(condition, message):  # type: (bool, Text) -> None
@@ -94,32 +143,49 @@ def _check(condition, message):  # type: (bool, Text) -> None
         _error(message)
 
 
+# Maps each action name to the GitFeatureApp method implementing it
+ACTIONS = {
+    'create': '_create_feature_action',
+    'checkout': '_checkout_feature_action',
+    'rebase': '_rebase_feature_action',
+    'push': '_push_feature_action',
+    'remove': '_remove_feature_action',
+}
+
+_EPILOG = """\
+Examples:
+  $> git-feature create myfeature   # Creates and checks out new feature 'myfeature'
+  $> git-feature checkout myfeature # Checks out existing local feature 'myfeature'
+  $> git-feature rebase myfeature   # Rebases 'myfeature' on top of current upstream/master
+  $> git-feature push myfeature     # Pushes 'myfeature' to origin for creation of a pull request
+  $> git-feature remove myfeature   # Removes 'myfeature' from local and 'origin' remote
+"""
+
+
+def _build_parser():  # type: () -> argparse.ArgumentParser
+    parser = argparse.ArgumentParser(description="Create, rebase and delete git feature branches.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=_EPILOG)
+    parser.add_argument('action', choices=ACTIONS.keys())
+    parser.add_argument('feature_name', type=str)
+    return parser
+
+
+_PARSER = _build_parser()
+
+# Rejects obviously malformed branch names before we do any network round trips for them
+_FEATURE_NAME_RE = re.compile("\\A[A-Za-z0-9][A-Za-z0-9._\\-/]{0,199}\\Z")
+
+
 class GitFeatureApp(object):
     def __init__(self):  # type: () -> None
-        self._actions = {
-            'create': self._create_feature_action,
-            'checkout': self._checkout_feature_action,
-            'rebase': self._rebase_feature_action,
-            'push': self._push_feature_action,
-            'remove': self._remove_feature_action,
-        }
         self._parse_args()
 
     def _parse_args(self):  # type: () -> None
-        parser = argparse.ArgumentParser(description="Create, rebase and delete git feature branches.",
-            formatter_class=argparse.RawTextHelpFormatter,
-            epilog=
-            "Examples:\n" +
-            "  $> git-feature create myfeature   # Creates and checks out new feature 'myfeature'\n" +
-            "  $> git-feature checkout myfeature # Checks out existing local feature 'myfeature'\n" +
-            "  $> git-feature rebase myfeature   # Rebases 'myfeature' on top of current upstream/master\n" +
-            "  $> git-feature push myfeature     # Pushes 'myfeature' to origin for creation of a pull request\n" +
-            "  $> git-feature remove myfeature   # Removes 'myfeature' from local and 'origin' remote\n")
-        parser.add_argument('action', choices=self._actions.keys())
-        parser.add_argument('feature_name', type=str)
-        args = parser.parse_args()
-        assert args.action in self._actions.keys()
-        self._action = self._actions[args.action]
+        args = _PARSER.parse_args()
+        if not _FEATURE_NAME_RE.match(args.feature_name):
+            _PARSER.error("invalid feature name: '%s'" % args.feature_name)
+        self._action = getattr(self, ACTIONS[args.action])
         self._feature_name = args.feature_name
 
     def run(self):  # type: () -> None
@@ -127,31 +193,24 @@ class GitFeatureApp(object):
         self._action()
 
     def _repo_setup_checks(self):  # type: () -> None
-        remotes = subprocess.check_output(['git', 'remote', '-v']).decode('UTF-8').split('\n')
-        _check(any(
-            [_contains(remotes, "upstream\t%s[a-zA-Z0-9\\-]+(\\.git)? \\(fetch\\)\s*$" % url_prefix) for url_prefix in OFFICIAL_REPO_URL_PREFIXES]
-        ), "Remote repository 'upstream' not setup correctly (fetch)")
-        _check(any(
-            [_contains(remotes, "upstream\t%s[a-zA-Z0-9\\-]+(\\.git)? \\(push\\)\s*$" % url_prefix) for url_prefix in OFFICIAL_REPO_URL_PREFIXES]
-        ), "Remote repository 'upstream' not setup correctly (push)")
-        _check(_contains(remotes, "origin\thttps://github\\.com/[a-zA-Z0-9\\-]+/[a-zA-Z0-9\\-]+(\\.git)? \\(fetch\\)\s*$") or
-               _contains(remotes, "origin\tgit@github\\.com:[a-zA-Z0-9\\-]+/[a-zA-Z0-9\\-]+(\\.git)? \\(fetch\\)\s*$"),
-               "Remote repository 'origin' not setup correctly (fetch)")
-        _check(_contains(remotes, "origin\thttps://github\\.com/[a-zA-Z0-9\\-]+/[a-zA-Z0-9\\-]+(\\.git)? \\(push\\)\s*$") or
-               _contains(remotes, "origin\tgit@github\\.com:[a-zA-Z0-9\\-]+/[a-zA-Z0-9\\-]+(\\.git)? \\(push\\)\s*$"),
-               "Remote repository 'origin' not setup correctly (push)")
-        _check(not any(
-            [_contains(remotes, "origin\t%s[a-zA-Z0-9\\-]+(\\.git)? \\(fetch\\)\s*$" % url_prefix) for url_prefix in OFFICIAL_REPO_URL_PREFIXES]
-        ), "Remote repository 'origin' points to official repository. Please point it to your own fork.")
+        upstream_owners = _get_remote_owners('upstream')
+        origin_owners = _get_remote_owners('origin')
+        for direction in REMOTE_DIRECTIONS:
+            _check(not upstream_owners[direction].isdisjoint(OFFICIAL_OWNERS),
+                   "Remote repository 'upstream' not setup correctly (%s)" % direction)
+        for direction in REMOTE_DIRECTIONS:
+            _check(len(origin_owners[direction]) > 0,
+                   "Remote repository 'origin' not setup correctly (%s)" % direction)
+        _check(origin_owners['fetch'].isdisjoint(OFFICIAL_OWNERS),
+               "Remote repository 'origin' points to official repository. Please point it to your own fork.")
 
     def _create_feature_action(self):  # type: () -> None
         print('-----------------------------------------------------------')
         print("Creating feature %s" % self._feature_name)
         print('-----------------------------------------------------------')
         _exec([
-            ['git', 'fetch', 'upstream'],
+            ['git', 'fetch', '--recurse-submodules=on-demand', 'upstream'],
             ['git', 'checkout', '-b', self._feature_name, 'upstream/master', '--no-track'],
-            ['git', 'submodule', 'foreach', 'git', 'fetch', '--all'],
             ['git', 'submodule', 'update', '--init', '--recursive'],
             ['git', 'push', '--set-upstream', 'origin', self._feature_name],
         ])
@@ -170,10 +229,9 @@ class GitFeatureApp(object):
         print("Rebasing feature %s on top of upstream/master" % self._feature_name)
         print('-----------------------------------------------------------')
         _exec([
-            ['git', 'fetch', 'upstream'],
+            ['git', 'fetch', '--recurse-submodules=on-demand', 'upstream'],
             ['git', 'checkout', self._feature_name],
             ['git', 'rebase', 'upstream/master'],
-            ['git', 'submodule', 'foreach', 'git', 'fetch', '--all'],
             ['git', 'submodule', 'update', '--init', '--recursive'],
         ])
 
@@ -181,12 +239,17 @@ class GitFeatureApp(object):
         print('-----------------------------------------------------------')
         print("Removing feature %s" % self._feature_name)
         print('-----------------------------------------------------------')
+        # These lookups are independent, and ls-remote needs a network round trip, so run them concurrently.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            current_branch = executor.submit(_get_current_branch)
+            local_branches = executor.submit(_get_local_branches)
+            remote_branches = executor.submit(_get_remote_branches, 'origin')
         commands = []
-        if _get_current_branch() == self._feature_name:
+        if current_branch.result() == self._feature_name:
             commands.append(['git', 'checkout', 'upstream/master'])
-        if _local_has_branch(self._feature_name):
+        if self._feature_name in local_branches.result():
             commands.append(['git', 'branch', '-d', self._feature_name])
-        if _remote_has_branch('origin', self._feature_name):
+        if self._feature_name in remote_branches.result():
             commands.append(['git', 'push', 'origin', ':%s' % self._feature_name])
         if len(commands) == 0:
             _error("Branch '%s' not found, neither in local repository nor in 'origin' remote" % self._feature_name)
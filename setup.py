@@ -20,12 +20,6 @@ setup(name='git-feature',
           'git-feature = onnx_git_feature.__main__:main'
         ],
       },
-      install_requires=[
-        'typing',
-        'argparse',
-        'typing',
-        'typing-extensions',
-      ],
       classifiers=[
         "Development Status :: 2 - Pre-Alpha",
         "Environment :: Console",